@@ -37,21 +37,37 @@ Paul J. Robinson, Columbia University, July 2022
 """
 
 from abc import ABC, abstractproperty
-import requests
-import json
+import asyncio
+import os
+import random
+import re
+import zlib
 from itertools import groupby
-from datetime import date
-from functools import cached_property
-
-import feedparser
+from datetime import date, datetime, timedelta
+from functools import cached_property, lru_cache
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+import xml.etree.ElementTree as ET
+
+from aiohttp_client_cache import CachedSession, SQLiteBackend
+from aiolimiter import AsyncLimiter
+import orjson
 from monty.json import MSONable
 
 
 try:
     from tqdm import tqdm
 except ImportError:
-    def tqdm(iterable):
-        return iterable
+    class tqdm:
+        def __init__(self, iterable=None, total=None):
+            pass
+
+        def update(self, n=1):
+            pass
+
+        def close(self):
+            pass
 
 
 """
@@ -63,15 +79,76 @@ arXiv_file = "../content/arXiv_ids.txt"
 
 output_file = "../source/publications"
 
+# Persistent cache of API responses, so re-runs only query for new entries
+http_cache_file = ".easypub_http_cache"
+
 """
 IMPORTANT Global Variables: Do not change unless API calls change
 """
 
 CROSSREF_API_BASE = "https://api.crossref.org/works/"
 CROSSREF_API_APP = "/transform/application/vnd.citationstyles.csl+json"
+CROSSREF_API_FILTER = "https://api.crossref.org/works?filter="
+
+# Maximum number of DOIs per filter query (see stable_chunks for the typical
+# number); much larger and CrossRef will reject the request URI as too long
+# (414)
+CROSSREF_BATCH_SIZE = 40
 
 CHEMRXIV_API_BASE = "http://chemrxiv.org/engage/chemrxiv/public-api/v1/items/doi/"
 ARXIV_API_BASE = "http://export.arxiv.org/api/query?id_list="
+# Maximum number of identifiers per arXiv id_list query (see stable_chunks)
+ARXIV_BATCH_SIZE = 200
+ARXIV_NS = {
+    "a": "http://www.w3.org/2005/Atom",
+    "arxiv": "http://arxiv.org/schemas/atom",
+}
+
+# Maximum number of requests in flight to any one API host at a time
+HOST_CONCURRENCY = 16
+
+# Requests per second allowed against any one API host until the host
+# advertises its own limit, in which case we aim for RATE_LIMIT_MARGIN of it.
+# Both undershoot CrossRef's polite pool limit of 50 requests per second.
+HOST_RATE_LIMIT = 45
+RATE_LIMIT_MARGIN = 0.9
+
+# Hosts with stricter limits than the defaults above, as (maximum concurrent
+# requests, requests per period, period in seconds). The arXiv asks for no
+# more than one request every three seconds.
+HOST_LIMITS = {
+    "export.arxiv.org": (1, 1, 3),
+}
+
+# How long cached API responses are reused. Published metadata is
+# effectively immutable, but the publication status of preprints changes.
+# Batch responses missing any of the requested entries are never cached.
+CACHE_EXPIRE_AFTER = timedelta(days=30)
+CACHE_URLS_EXPIRE_AFTER = {
+    "api.crossref.org": timedelta(days=30),
+    "export.arxiv.org": timedelta(days=1),
+    "chemrxiv.org": timedelta(days=1),
+}
+
+# Responses which are retried with exponential backoff
+RETRY_STATUS_CODES = (429, 503)
+MAX_RETRIES = 4
+
+# Formatting of the publication page
+ARTICLE_TEMPLATE = (
+    "{authors}"
+    '<span class="title"><a href="{url}"> {title}</a>. </span>'
+    '<span class="journal">{journal} </span>'
+    "{vol}{page}"
+    '<span class="year">({year})</span>.'
+)
+
+LIST_ITEM_TEMPLATE = (
+    '<li value="{num}">\n'
+    '<a class="anchor" name="{anchor}_{num}"></a>\n'
+    "{article}\n"
+    "</li>\n"
+)
 
 """
 Code
@@ -89,40 +166,312 @@ def read_text_file(filename):
     Returns
     -------
     list
-        A list [of str] of the entries in the file.
+        A list [of str] of the entries in the file. Blank lines are skipped.
     """
 
     with open(filename, "r") as f:
-        lines = f.readlines()
-    return [line.strip() for line in lines]
+        return [line.strip() for line in f if line.strip()]
+
+
+def stable_chunks(keys, max_size):
+    """Splits keys into chunks for batch queries. The keys are sorted, and a
+    chunk ends after any key whose hash is divisible by max_size (or once it
+    reaches max_size). Chunk boundaries therefore depend on the keys
+    themselves rather than their positions, so adding or removing one key
+    changes only the chunk containing it (and at most the chunks following
+    it up to the next hash boundary), and the cached responses of all other
+    chunks are reused.
 
+    The price is that chunks are smaller than max_size on average: about
+    0.64 * max_size (e.g. 25 for max_size=40), so a cold run sends roughly
+    1.6 times the minimum number of batch queries.
+
+    Parameters
+    ----------
+    keys : list
+        A list [of str] of e.g. DOIs.
+    max_size : int
+
+    Returns
+    -------
+    list
+        A list [of list of str] of chunks.
+    """
+
+    chunks = []
+    chunk = []
+    for key in sorted(keys, key=str.lower):
+        chunk.append(key)
+        boundary = zlib.crc32(key.lower().encode()) % max_size == 0
+        if boundary or len(chunk) == max_size:
+            chunks.append(chunk)
+            chunk = []
+    if len(chunk) > 0:
+        chunks.append(chunk)
+    return chunks
+
+
+def _parse_rate_limit(headers):
+    """Reads the X-Rate-Limit-Limit and X-Rate-Limit-Interval headers (e.g.
+    "50" and "1s") returned by CrossRef.
+
+    Returns
+    -------
+    tuple or None
+        The number of requests (int) allowed per interval (float, seconds),
+        or None if the headers are absent or malformed.
+    """
+
+    limit = headers.get("X-Rate-Limit-Limit")
+    interval = headers.get("X-Rate-Limit-Interval")
+    if limit is None or interval is None:
+        return None
+    units = {"s": 1.0, "m": 60.0, "h": 3600.0}
+    try:
+        if interval[-1] in units:
+            seconds = float(interval[:-1]) * units[interval[-1]]
+        else:
+            seconds = float(interval)
+        return int(limit), seconds
+    except (ValueError, IndexError):
+        return None
 
-def get_CrossRef(doi):
+
+def open_cached_session():
+    """Opens a client session backed by the persistent response cache.
+
+    Returns
+    -------
+    aiohttp_client_cache.CachedSession
+        A drop-in replacement for aiohttp.ClientSession.
+    """
+
+    cache = SQLiteBackend(
+        cache_name=http_cache_file,
+        expire_after=CACHE_EXPIRE_AFTER,
+        urls_expire_after=CACHE_URLS_EXPIRE_AFTER,
+        allowed_codes=(200,),
+    )
+    return CachedSession(cache=cache)
+
+
+class HostSession:
+    """Wraps an aiohttp.ClientSession such that no more than a fixed number
+    of requests are in flight to any single host at a time, and requests to
+    each host are rate limited. Responses with a status code in
+    RETRY_STATUS_CODES are retried with exponential backoff.
+
+    Parameters
+    ----------
+    session : aiohttp.ClientSession
+    concurrency : int, optional
+        The maximum number of concurrent requests per host.
+    rate_limit : int, optional
+        The initial maximum number of requests per second per host. This is
+        replaced by the limit a host advertises in its response headers.
+    host_limits : dict, optional
+        Overrides of the above for specific hosts, as a tuple of (concurrency,
+        requests per period, period in seconds) keyed by host name.
+    """
+
+    def __init__(
+        self,
+        session,
+        concurrency=HOST_CONCURRENCY,
+        rate_limit=HOST_RATE_LIMIT,
+        host_limits=HOST_LIMITS,
+    ):
+        self._session = session
+        self._concurrency = concurrency
+        self._rate_limit = rate_limit
+        self._host_limits = host_limits
+        self._semaphores = dict()
+        self._limiters = dict()
+        self._configured_hosts = set()
+
+    def _semaphore(self, host):
+        if host not in self._semaphores:
+            concurrency = self._concurrency
+            if host in self._host_limits:
+                concurrency = self._host_limits[host][0]
+            self._semaphores[host] = asyncio.Semaphore(concurrency)
+        return self._semaphores[host]
+
+    def _limiter(self, host):
+        if host not in self._limiters:
+            max_rate, time_period = self._rate_limit, 1
+            if host in self._host_limits:
+                max_rate, time_period = self._host_limits[host][1:]
+            self._limiters[host] = AsyncLimiter(max_rate, time_period)
+        return self._limiters[host]
+
+    def _configure_limiter(self, host, headers):
+        """Replaces the limiter of a host with one matching the rate limit it
+        advertises in the headers of its first response."""
+
+        if host in self._configured_hosts:
+            return
+        self._configured_hosts.add(host)
+        rate_limit = _parse_rate_limit(headers)
+        if rate_limit is None:
+            return
+        limit, interval = rate_limit
+        max_rate = max(1, int(limit * RATE_LIMIT_MARGIN))
+        self._limiters[host] = AsyncLimiter(max_rate, interval)
+
+    async def _is_cached(self, url):
+        cache = getattr(self._session, "cache", None)
+        return cache is not None and await cache.has_url(url)
+
+    async def get(self, url):
+        """Performs a GET request. Responses already in the session's cache
+        are returned straight away, without taking up a concurrency slot or
+        counting against the rate limit of the host.
+
+        Parameters
+        ----------
+        url : str
+
+        Returns
+        -------
+        tuple
+            The status code (int) and raw body (bytes) of the response.
+        """
+
+        if await self._is_cached(url):
+            async with self._session.get(url) as resp:
+                return resp.status, await resp.read()
+
+        host = urlsplit(url).netloc
+        for attempt in range(MAX_RETRIES + 1):
+            async with self._semaphore(host), self._limiter(host):
+                async with self._session.get(url) as resp:
+                    self._configure_limiter(host, resp.headers)
+                    status = resp.status
+                    body = await resp.read()
+            if status not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                return status, body
+            await asyncio.sleep(2**attempt + random.random())
+
+    async def uncache(self, url):
+        """Removes the cached response to a GET request, if any, so that it
+        is fetched again next time.
+
+        Parameters
+        ----------
+        url : str
+        """
+
+        cache = getattr(self._session, "cache", None)
+        if cache is not None:
+            await cache.delete_url(url)
+
+
+async def get_CrossRef(session, doi):
     """Uses the CrossRef API to extract article metadata
     
     Parameters
     ----------
+    session : HostSession
     doi : str
         The DOI of the manuscript.
     
     Returns
     -------
-    dict
-    
-    Raises
-    ------
-    RuntimeError
-        If the API request returns error code 404.
+    dict or None
+        None if the API request fails (e.g. returns error code 404).
     """
 
     req_url = CROSSREF_API_BASE + doi + CROSSREF_API_APP
 
-    req_json = requests.get(req_url)
+    status, body = await session.get(req_url)
+
+    if status != 200:
+        return None
+
+    return orjson.loads(body)
+
 
-    if req_json.status_code == 404:
-        raise RuntimeError(f"Crossref returned error code 404 on doi {doi}")
+def _flatten_works_item(item):
+    """CrossRef's /works endpoint returns some fields as lists where the CSL
+    transform returns plain strings, and names the short journal title
+    short-container-title rather than container-title-short. Converts an item
+    to the CSL form in place; empty lists are dropped as missing fields."""
+
+    if "short-container-title" in item:
+        item["container-title-short"] = item.pop("short-container-title")
+    for key in ["title", "container-title", "container-title-short"]:
+        value = item.get(key)
+        if not isinstance(value, list):
+            continue
+        if len(value) > 0:
+            item[key] = value[0]
+        else:
+            del item[key]
 
-    return req_json.json()
+
+async def get_CrossRef_batch(session, dois):
+    """Uses a single CrossRef filter query to extract the metadata of several
+    articles at once.
+
+    Parameters
+    ----------
+    session : HostSession
+    dois : list
+        A list [of str] of DOIs. Should contain no more than
+        CROSSREF_BATCH_SIZE entries.
+
+    Returns
+    -------
+    dict or None
+        The metadata of each article found, keyed by lowercased DOI. DOIs
+        which CrossRef does not know about are simply absent. None if the
+        API request fails, in which case no DOI in the batch was looked up.
+    """
+
+    filters = ",".join(f"doi:{doi}" for doi in dois)
+    req_url = CROSSREF_API_FILTER + filters + f"&rows={len(dois)}"
+
+    status, body = await session.get(req_url)
+
+    if status != 200:
+        return None
+
+    found = dict()
+    for item in orjson.loads(body)["message"]["items"]:
+        _flatten_works_item(item)
+        found[item["DOI"].lower()] = item
+
+    # Don't let the cache hide DOIs which CrossRef has yet to index
+    if len(found) < len(set(doi.lower() for doi in dois)):
+        await session.uncache(req_url)
+    return found
+
+
+def get_CrossRef_sync(doi):
+    """Blocking counterpart of get_CrossRef for one-off lookups. Does not use
+    an event loop or the response cache, so it is safe to call from within
+    a running event loop (e.g. Jupyter).
+
+    Parameters
+    ----------
+    doi : str
+        The DOI of the manuscript.
+
+    Returns
+    -------
+    dict or None
+        None if the API request returns error code 404.
+    """
+
+    req_url = CROSSREF_API_BASE + doi + CROSSREF_API_APP
+    try:
+        with urlopen(req_url) as resp:
+            return orjson.loads(resp.read())
+    except HTTPError as err:
+        if err.code == 404:
+            return None
+        raise
 
 
 class Publication(ABC):
@@ -172,8 +521,13 @@ class CrossRefPublication(Publication, MSONable):
 
     def __init__(self, doi, metadata=None):
         self._doi = doi
+        self._metadata = metadata
         if metadata is None:
-            self._metadata = get_CrossRef(self.doi)
+            self._metadata = get_CrossRef_sync(self.doi)
+            if self._metadata is None:
+                raise RuntimeError(
+                    f"Crossref returned error code 404 on doi {doi}"
+                )
 
     @property
     def authors_list(self):
@@ -230,35 +584,33 @@ class ChemArxivPublication(Publication):
 
 def main():
 
-    fmt = "${authors}. ${title}. ${journal} ${volume}, ${number} (${year})"
-
-    list_of_DOI = read_text_file("test.txt")
-    pub = CrossRefPublication(list_of_DOI[0])
-    print(pub.format(fmt))
-    return
-
-    list_of_preprint = read_text_file(arXiv_file, dtype=str)
+    list_of_DOI = read_text_file(doi_file)
+    list_of_preprint = read_text_file(arXiv_file)
     error_doi = []
     error_doi_preprint = []
     published_doi_preprint = []
 
+    preload_manual_json()
+
+    print("Querying ArXiv, ChemRXiv and CrossRef for Article Metadata:")
+    preprint_results, published_results = asyncio.run(
+        gather_all(list_of_preprint, list_of_DOI)
+    )
+
     preprint_json = []
-    print("Querying ArXiv and ChemRXiv for Preprint Metadata:")
-    for preprint_i in tqdm(list_of_preprint):
-        json_i = None
-        try:
-            json_i = preprint_api_calls(preprint_i)
-            try:
-                if json_i["status_published"] is True:
-                    published_doi_preprint.append(preprint_i)
-            except KeyError:
-                # preprint publication status unknown
-                pass
-        except ImportError:
+    for preprint_i, json_i in zip(list_of_preprint, preprint_results):
+        if json_i is None:
             error_doi_preprint.append(preprint_i)
             continue
-        else:
-            preprint_json.append(json_i)
+        elif isinstance(json_i, BaseException):
+            raise json_i
+        try:
+            if json_i["status_published"] is True:
+                published_doi_preprint.append(preprint_i)
+        except KeyError:
+            # preprint publication status unknown
+            pass
+        preprint_json.append(json_i)
 
     if len(published_doi_preprint) > 0:
         print("The following preprints were detected as having been published:")
@@ -274,16 +626,13 @@ def main():
         )
 
     published_json = []
-    print("Querying CrossRef and Preprint Servers for Article Metadata:")
-    for doi_i in tqdm(list_of_DOI):
-        json_i = None
-        try:
-            json_i = published_api_calls(doi_i)
-        except ImportError:
+    for doi_i, json_i in zip(list_of_DOI, published_results):
+        if json_i is None:
             error_doi.append(doi_i)
             continue
-        else:
-            published_json.append(json_i)
+        elif isinstance(json_i, BaseException):
+            raise json_i
+        published_json.append(json_i)
 
     if len(error_doi) > 0:
         print("The following papers were not found:")
@@ -293,140 +642,243 @@ def main():
             manual_json_dir,
         )
 
-    published_json = sorted(published_json, key=sort_date_function, reverse=True)
+    # Compute the sort keys once each, rather than again during groupby
+    decorated = [
+        (sort_date_function(j), sort_year_function(j), j)
+        for j in published_json
+    ]
+    decorated.sort(key=lambda t: t[0], reverse=True)
+
+    article_num = len(decorated) + len(preprint_json)
 
-    article_num = len(published_json) + len(preprint_json)
+    # Assemble the page in memory and write it out in one go
+    parts = [
+        '<div id="main"> \n',
+        "<h2>Publications</h2> \n",
+        "<h3>Preprints</h3> \n",
+        '<ol class="pubs"> \n',
+    ]
+    for preprint_i in preprint_json:
+        parts.append(
+            LIST_ITEM_TEMPLATE.format(
+                num=article_num,
+                anchor="preprint",
+                article=format_article(preprint_i),
+            )
+        )
+        article_num -= 1
+    parts.append("</ol>\n")
+
+    by_year = groupby(decorated, key=lambda t: t[1])
+    for year_i, jsons_year_i in by_year:
+        parts.append(f'<h3>{year_i}</h3>\n<ol class="pubs">\n')
+        for _, _, json_j in jsons_year_i:
+            parts.append(
+                LIST_ITEM_TEMPLATE.format(
+                    num=article_num,
+                    anchor="article",
+                    article=format_article(json_j).rstrip("\n"),
+                )
+            )
+            article_num -= 1
+        parts.append("</ol>\n")
+    parts.append("</div> <!-- End main -->")
 
     with open(output_file, "w") as outfile:
-        outfile.write('<div id="main"> \n')
-        outfile.write("<h2>Publications</h2> \n")
-        outfile.write("<h3>Preprints</h3> \n")
-        outfile.write('<ol class="pubs"> \n')
-        for preprint_i in preprint_json:
-            outfile.write(f'<li value="{article_num}">')
-            outfile.write("\n")
-            outfile.write(f'<a class="anchor" name="preprint_{article_num}"></a>')
-            outfile.write("\n")
-            outfile.write(format_article(preprint_i))
-            outfile.write("\n")
-            outfile.write("</li>")
-            outfile.write("\n")
-            article_num -= 1
-        outfile.write("</ol>")
-        outfile.write("\n")
-
-        for year_i, jsons_year_i in groupby(published_json, key=sort_year_function):
-            outfile.write(f"<h3>{year_i}</h3>")
-            outfile.write("\n")
-            outfile.write('<ol class="pubs">')
-            outfile.write("\n")
-            for json_j in jsons_year_i:
-                outfile.write(f'<li value="{article_num}">')
-                outfile.write("\n")
-                outfile.write(f'<a class="anchor" name="article_{article_num}"></a>')
-                outfile.write("\n")
-                outfile.write(format_article(json_j).rstrip("\n"))
-                outfile.write("\n")
-                outfile.write("</li>")
-                outfile.write("\n")
-                article_num -= 1
-            outfile.write("</ol>")
-            outfile.write("\n")
-        outfile.write("</div> <!-- End main -->")
+        outfile.write("".join(parts))
+
+
+async def gather_with_progress(aws):
+    """
+    Awaits all awaitables concurrently while updating a progress bar
+
+    return: list of results (or raised exceptions) in input order
+    """
+    progress = tqdm(total=len(aws))
+
+    async def _tick(aw):
+        try:
+            return await aw
+        finally:
+            progress.update(1)
+
+    try:
+        return await asyncio.gather(
+            *[_tick(aw) for aw in aws], return_exceptions=True
+        )
+    finally:
+        progress.close()
+
+
+async def gather_all(list_of_preprint, list_of_DOI):
+    """
+    Queries every API concurrently
+
+    param: list_of_preprint (list) preprint identifiers
+    param: list_of_DOI (list) DOIs of published articles
+
+    return: two lists containing the metadata (None if not found, or the
+        raised exception) of each preprint and of each published article, in
+        input order
+    """
+    async with open_cached_session() as client:
+        session = HostSession(client)
+
+        # Manual metadata takes precedence, so only batch query CrossRef and
+        # the arXiv for the rest
+        crossref_dois = [
+            doi_i for doi_i in list_of_DOI if not has_manual_json(doi_i)
+        ]
+        arXiv_prefixes = [
+            preprint_i
+            for preprint_i in list_of_preprint
+            if "arxiv" in preprint_i.lower()
+            and "chemrxiv" not in preprint_i.lower()
+            and not has_manual_json(preprint_i)
+        ]
+        crossref_chunks = stable_chunks(crossref_dois, CROSSREF_BATCH_SIZE)
+        crossref_tasks = [
+            get_CrossRef_batch(session, chunk) for chunk in crossref_chunks
+        ]
+        arXiv_tasks = [
+            get_arXiv_batch(session, chunk)
+            for chunk in stable_chunks(arXiv_prefixes, ARXIV_BATCH_SIZE)
+        ]
+        crossref_batches, arXiv_batches = await asyncio.gather(
+            asyncio.gather(*crossref_tasks),
+            asyncio.gather(*arXiv_tasks),
+        )
+
+        # DOIs of failed batches are queried from CrossRef individually
+        crossref_json = dict()
+        crossref_failed = set()
+        for chunk, batch in zip(crossref_chunks, crossref_batches):
+            if batch is None:
+                crossref_failed.update(doi_i.lower() for doi_i in chunk)
+            else:
+                crossref_json.update(batch)
+        arXiv_json = dict()
+        for batch in arXiv_batches:
+            arXiv_json.update(batch)
+
+        # Anything not found in the batches is queried individually
+        preprint_tasks = [
+            preprint_api_calls(session, preprint_i, arXiv_json)
+            for preprint_i in list_of_preprint
+        ]
+        published_tasks = [
+            published_api_calls(
+                session,
+                doi_i,
+                None if doi_i.lower() in crossref_failed else crossref_json,
+            )
+            for doi_i in list_of_DOI
+        ]
+        results = await gather_with_progress(preprint_tasks + published_tasks)
+
+    preprint_results = results[: len(preprint_tasks)]
+    published_results = results[len(preprint_tasks) :]
+    return preprint_results, published_results
+
+
+def _get_date_parts(j, key):
+    """
+    The [year, month, day] date parts (possibly truncated) of an article
+    under key, or an empty list if there are none
+    """
+    date_parts = j.get(key, {}).get("date-parts", [[]])
+    return date_parts[0] if len(date_parts) > 0 else []
 
 
 def sort_year_function(j):
     """
     Provides year for each article. If day of month not given then assumes 1st.
     """
-    try:
-        return j["published"]["date-parts"][0][0]
-    except KeyError:
-        try:
-            return j["created"]["date-parts"][0][0]
-        except KeyError:
-            return 0
+    for key in ("published", "created"):
+        date_list = _get_date_parts(j, key)
+        if len(date_list) > 0:
+            return int(date_list[0])
+    return 0
 
 
 def sort_date_function(j):
     """
-    Provides a UNIX time for each article. If day of month not given then assumes 1st.
+    Provides a datetime.date for each article. If month or day not given
+    then assumes 1st. Uses the same date parts as sort_year_function, so
+    that the sort order agrees with the grouping by year. Articles without
+    a year get date.min and so sort last.
     """
-    try:
-        date_list = j["published"]["date-parts"][0]
-        if len(date_list) == 2:
-            date_list.append(1)
-        if len(date_list) < 2:
-            raise KeyError
-        return date(*date_list)
-    except KeyError:
-        try:
-            date_list = j["created"]["date-parts"][0]
-            if len(date_list) == 2:
-                date_list.append(1)
-            return date(*date_list)
-        except KeyError:
-            return 0
+    for key in ("published", "created"):
+        date_list = _get_date_parts(j, key)
+        if len(date_list) > 0:
+            year, month, day = (list(date_list[:3]) + [1, 1])[:3]
+            return date(int(year), int(month), int(day))
+    return date.min
 
 
-def published_api_calls(doi):
+async def published_api_calls(session, doi, crossref_json=None):
     """
     Attempts all API calls
+
+    param: session (HostSession)
+    param: crossref_json (dict) metadata already retrieved via
+        get_CrossRef_batch, keyed by lowercased DOI. If None, CrossRef is
+        queried for this DOI alone.
     """
-    json_return = None
-    try:
-        json_return = get_manual_json(doi)
+    json_return = get_manual_json(doi)
 
     # Why do you try manual json first before using crossREf?
-    except ImportError:
-        try:
-            json_return = get_CrossRef(doi)
-        except ImportError:
-            json_return = preprint_api_calls(doi)
+    if json_return is None:
+        if crossref_json is None:
+            json_return = await get_CrossRef(session, doi)
+        else:
+            json_return = crossref_json.get(doi.lower())
+    if json_return is None:
+        json_return = await preprint_api_calls(session, doi)
     return json_return
 
 
-def preprint_api_calls(doi):
+async def preprint_api_calls(session, doi, arXiv_json=None):
     """
     Attempts preprint server API calls
+
+    param: session (HostSession)
+    param: arXiv_json (dict) metadata already retrieved via get_arXiv_batch,
+        keyed by preprint identifier
     """
-    json_return = None
-    if "chemrxiv" in doi.lower():
-        try:
-            json_return = get_manual_json(doi)
-        except ImportError:
-            json_return = get_chemRXiv(doi)
+    json_return = get_manual_json(doi)
+    if json_return is not None:
         return json_return
 
-    elif "arxiv" in doi.lower():
-        try:
-            json_return = get_manual_json(doi)
-        except ImportError:
-            json_return = get_arXiv(doi)
-        return json_return
+    if "chemrxiv" in doi.lower():
+        return await get_chemRXiv(session, doi)
 
-    else:
-        json_return = get_manual_json(doi)
+    elif "arxiv" in doi.lower():
+        if arXiv_json is not None:
+            json_return = arXiv_json.get(doi)
+        if json_return is None:
+            json_return = await get_arXiv(session, doi)
         return json_return
 
-    raise ImportError
+    return None
 
 
-def get_chemRXiv(doi):
+async def get_chemRXiv(session, doi):
     """
     Uses the chemRXiv API to extract metadata
+    param: session (HostSession)
     param: doi (str)
 
-    returns: json object
+    returns: json object, or None if not found (or the request fails)
     """
     req_url = CHEMRXIV_API_BASE + doi
 
-    req_json = requests.get(req_url)
+    status, body = await session.get(req_url)
 
-    if req_json.status_code == 404:
-        raise ImportError
+    if status != 200:
+        return None
 
-    json_i = req_json.json()
+    json_i = orjson.loads(body)
     json_i["container-title"] = "ChemRxiv"
     json_i["published"] = {
         "date-parts": [json_i["publishedDate"].split("T")[0].split("-")]
@@ -436,42 +888,116 @@ def get_chemRXiv(doi):
     return json_i
 
 
-def get_arXiv(prefix):
+async def get_arXiv(session, prefix):
     """
     Uses the ArXiv API to extract metadata
+    param: session (HostSession)
     param: arxiv prefix (str)
 
-    return: dictionary with same attributes as other JSON objects
+    return: dictionary with same attributes as other JSON objects, or None if
+        not found (or the request fails)
     """
     prefix_full = prefix
-    if ":" in prefix:
-        prefix = prefix.split(":")[1]
+    prefix = _strip_arXiv_scheme(prefix)
     req_url = ARXIV_API_BASE + prefix
-    req_xml = requests.get(req_url)
-    if req_xml.status_code == 404:
-        raise ImportError
+    status, body = await session.get(req_url)
+    if status != 200:
+        return None
+
+    if b"incorrect_id_format_for_" + prefix.encode() in body:
+        return None
+
+    entry = ET.fromstring(body).find("a:entry", ARXIV_NS)
+    if entry is None:
+        return None
+
+    return _parse_arXiv_entry(entry, prefix, prefix_full)
 
-    if "incorrect_id_format_for_" + prefix in req_xml.text:
-        raise ImportError
 
-    xml_struct = feedparser.parse(req_xml.text)
+def _strip_arXiv_scheme(prefix):
+    """Strips any "arXiv:" scheme from an identifier"""
+    return prefix.split(":")[1] if ":" in prefix else prefix
 
-    authors = xml_struct.entries[0].authors
-    title = xml_struct.entries[0].title
-    year = xml_struct.entries[0].published_parsed.tm_year
-    month = xml_struct.entries[0].published_parsed.tm_mon
-    day = xml_struct.entries[0].published_parsed.tm_mday
-    # url = xml_struct.entries[0].link
+
+def _arXiv_id(prefix):
+    """Strips any "arXiv:" scheme and version suffix from an identifier"""
+    return re.sub(r"v[0-9]+$", "", _strip_arXiv_scheme(prefix))
+
+
+async def get_arXiv_batch(session, prefixes):
+    """
+    Uses a single ArXiv id_list query to extract the metadata of several
+    preprints at once
+    param: session (HostSession)
+    param: prefixes (list) arxiv prefixes, no more than ARXIV_BATCH_SIZE
+
+    return: dictionary of the metadata of each preprint found, keyed by the
+        given prefix. A prefix with a version suffix (e.g. 2101.00001v1) gets
+        that version, one without gets the latest version returned, so several
+        versions of the same preprint may be listed. If any prefix is
+        malformed the arXiv rejects the whole query, in which case nothing is
+        returned.
+    """
+    bare = [_strip_arXiv_scheme(prefix) for prefix in prefixes]
+    req_url = ARXIV_API_BASE + ",".join(bare) + f"&max_results={len(bare)}"
+    status, body = await session.get(req_url)
+    if status != 200:
+        return dict()
+    if b"incorrect_id_format_for_" in body:
+        await session.uncache(req_url)
+        return dict()
+
+    # Given prefixes by versioned and by unversioned identifier
+    versioned = dict()
+    unversioned = dict()
+    for prefix in prefixes:
+        arXiv_id = _strip_arXiv_scheme(prefix)
+        by_id = unversioned if arXiv_id == _arXiv_id(arXiv_id) else versioned
+        by_id.setdefault(arXiv_id, []).append(prefix)
+
+    found = dict()
+    found_version = dict()
+    for entry in ET.fromstring(body).findall("a:entry", ARXIV_NS):
+        # The returned <id> always carries a version, e.g. 2101.00001v2
+        entry_id = entry.findtext("a:id", "", ARXIV_NS).split("/abs/")[-1]
+        base_id = _arXiv_id(entry_id)
+        version = int(entry_id[len(base_id) + 1 :] or 0)
+        matches = list(versioned.get(entry_id, []))
+        for prefix_full in unversioned.get(base_id, []):
+            if found_version.get(prefix_full, -1) < version:
+                found_version[prefix_full] = version
+                matches.append(prefix_full)
+        for prefix_full in matches:
+            found[prefix_full] = _parse_arXiv_entry(
+                entry, _strip_arXiv_scheme(prefix_full), prefix_full
+            )
+
+    if len(found) < len(set(prefixes)):
+        await session.uncache(req_url)
+    return found
+
+
+def _parse_arXiv_entry(entry, prefix, prefix_full):
+    """
+    Extracts the metadata of a single preprint from an ArXiv Atom feed entry
+    param: entry (xml.etree.ElementTree.Element)
+    param: prefix (str) the arxiv prefix without any "arXiv:" scheme
+    param: prefix_full (str) the arxiv prefix as given
+
+    return: dictionary with same attributes as other JSON objects
+    """
+    authors = [
+        {"name": author.findtext("a:name", "", ARXIV_NS)}
+        for author in entry.findall("a:author", ARXIV_NS)
+    ]
+    title = " ".join(entry.findtext("a:title", "", ARXIV_NS).split())
+    published_date = datetime.fromisoformat(
+        entry.findtext("a:published", "", ARXIV_NS).rstrip("Z")
+    )
+    # url = entry.find("a:link", ARXIV_NS).get("href")
     url = "http://arxiv.org/abs/" + prefix
-    article_id = xml_struct.entries[0].id
 
-    published = False
-    try:
-        xml_struct.entries[0].arxiv_journal_ref
-    except AttributeError:
-        pass
-    else:
-        published = True
+    published = entry.find("arxiv:journal_ref", ARXIV_NS) is not None
 
     for i, author in enumerate(authors):
         fullName = author["name"]
@@ -484,7 +1010,11 @@ def get_arXiv(prefix):
 
     dict_return = {
         "title": title,
-        "published": {"date-parts": [[year, month, day]]},
+        "published": {
+            "date-parts": [
+                [published_date.year, published_date.month, published_date.day]
+            ]
+        },
         "authors": authors,
         "URL": url,
         "container-title": prefix_full,
@@ -494,24 +1024,53 @@ def get_arXiv(prefix):
     return dict_return
 
 
+# Contents of manual_json_dir keyed by file name (without the extension)
+_manual_json = None
+
+
+def preload_manual_json(directory=None):
+    """
+    Reads every locally stored JSON file into memory, so that subsequent
+    lookups do not touch the disk
+
+    param: directory (str) defaults to manual_json_dir
+    """
+    global _manual_json
+    if directory is None:
+        directory = manual_json_dir
+
+    preload = dict()
+    if os.path.isdir(directory):
+        for fileName in os.listdir(directory):
+            if not fileName.endswith(".json"):
+                continue
+            with open(os.path.join(directory, fileName), "rb") as json_file:
+                preload[fileName[:-5]] = orjson.loads(json_file.read())
+    _manual_json = preload
+
+
+def _manual_json_key(doi):
+    return doi.replace("/", "-").replace(":", "-").strip()
+
+
+def has_manual_json(doi):
+    """
+    Whether a locally stored JSON file exists for a DOI
+    """
+    if _manual_json is None:
+        preload_manual_json()
+    return _manual_json_key(doi) in _manual_json
+
+
 def get_manual_json(doi):
     """
     Uses locally stored JSON files
-    """
-    return_json = None
-    fileName = (
-        manual_json_dir
-        + "/"
-        + doi.replace("/", "-").replace(":", "-").strip()
-        + ".json"
-    )
-    try:
-        with open(fileName, "r") as json_file:
-            return_json = json.load(json_file)
-    except IOError:
-        raise ImportError
 
-    return return_json
+    return: json object, or None if there is no file for the DOI
+    """
+    if _manual_json is None:
+        preload_manual_json()
+    return _manual_json.get(_manual_json_key(doi))
 
 
 def get_author_str(json_i):
@@ -546,6 +1105,7 @@ def get_author_str(json_i):
     return author_str + ","
 
 
+@lru_cache(maxsize=4096)
 def transform_given(name):
     """
     Formats first and middle name to APA intials
@@ -558,45 +1118,28 @@ def transform_given(name):
     return name
 
 
-def get_journal_str(json_i):
-    j_string = '<span class="journal">'
-    try:
-        j_string += json_i["container-title"].strip()
-    except KeyError:
-        j_string += json_i["container-title-short"].strip()
-    j_string += " </span>"
-    return j_string
-
-
-def get_vol_str(json_i):
-    try:
-        return '<span class="vol">' + json_i["volume"] + ", </span>"
-    except KeyError:
-        return ""
-
-
-def get_page_str(json_i):
-    p_string = '<span class="pages">'
-    try:
-        p_string += json_i["page"]
-    except KeyError:
-        try:
-            p_string += json_i["article-number"]
-        except KeyError:
-            return ""
-    p_string += " </span>"
-
-    return p_string
-
-
-def get_year_str(json_i):
-    return f'<span class="year">({json_i["published"]["date-parts"][0][0]})</span>'
+def _extract_fields(json_i):
+    """
+    Collects the fields of ARTICLE_TEMPLATE for a single article
 
+    param: json_i json for a single article
 
-def get_linked_title(json_i):
-    url = json_i["URL"]
-    title = json_i["title"]
-    return f'<span class="title"><a href="{url}"> {title}</a>. </span>'
+    return: dictionary of formatted strings
+    """
+    journal = json_i.get("container-title")
+    if journal is None:
+        journal = json_i["container-title-short"]
+    vol = json_i.get("volume")
+    page = json_i.get("page", json_i.get("article-number"))
+    return {
+        "authors": get_author_str(json_i),
+        "url": json_i["URL"],
+        "title": json_i.get("title", ""),
+        "journal": journal.strip(),
+        "vol": "" if vol is None else f'<span class="vol">{vol}, </span>',
+        "page": "" if page is None else f'<span class="pages">{page} </span>',
+        "year": json_i["published"]["date-parts"][0][0],
+    }
 
 
 def format_article(json_i):
@@ -607,16 +1150,7 @@ def format_article(json_i):
 
     return: formatted string
     """
-    article_i_str = ""
-    article_i_str += get_author_str(json_i)
-    article_i_str += get_linked_title(json_i)
-    article_i_str += get_journal_str(json_i)
-    article_i_str += get_vol_str(json_i)
-    article_i_str += get_page_str(json_i)
-    article_i_str += get_year_str(json_i)
-    article_i_str += "."
-
-    return article_i_str
+    return ARTICLE_TEMPLATE.format_map(_extract_fields(json_i))
 
 
 if __name__ == "__main__":